@@ -8,7 +8,8 @@ from agno.models.google import Gemini
 from pydantic import BaseModel, Field
 from repomix import RepomixConfig, RepoProcessor
 
-from agent.settings import GEMINI_MODEL_ID
+from agent.settings import GEMINI_MODEL_ID, TOKEN_BUDGETS
+from lib.budget import Section, fit_sections, report_usage
 from lib.utils import clean_repomix_output, exist, read, write
 
 
@@ -301,14 +302,21 @@ def explain_repo(config: str):
     c = load_config(config)
     code_for_agent = pack_code_into_markdown(c)
 
-    if c.mode == "explanation":
-        print("Explaining code...")
-        write(c.report, code_explainer_agent.run(code_for_agent).content)
-    elif c.mode == "tutorial":
-        print("Generating tutorial...")
-        write(c.report, code_teacher_agent.run(code_for_agent).content)
-    elif c.mode == "review":
-        print("Reviewing code...")
-        write(c.report, code_reviewer_agent.run(code_for_agent).content)
-    else:
+    agents = {
+        "explanation": ("Explaining code...", code_explainer_agent),
+        "tutorial": ("Generating tutorial...", code_teacher_agent),
+        "review": ("Reviewing code...", code_reviewer_agent),
+    }
+    if c.mode not in agents:
         print("Invalid mode. Please choose either 'explanation' or 'tutorial'.")
+        return
+
+    message, agent = agents[c.mode]
+    print(message)
+    # the packed repo is sent as it is, only its tail is cut when over budget
+    prompt = fit_sections(
+        [Section(None, code_for_agent, 0)], TOKEN_BUDGETS["code_explain"], agent.name
+    )
+    response = agent.run(prompt)
+    report_usage(agent.name, prompt, response)
+    write(c.report, response.content)
@@ -1,7 +1,10 @@
 # Reference: https://github.com/dzhng/deep-research
 
 import json
+import re
 import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from textwrap import dedent
 from typing import List, Literal
 
@@ -10,13 +13,34 @@ from agno.models.google import Gemini
 from agno.models.groq import Groq
 from pydantic import BaseModel, Field
 
-from agent.settings import GEMINI_MODEL_ID, GROQ_MODEL_ID
-from lib.utils import get_block_body, output_content, search_topic, send_mail
+from agent.settings import (
+    ANALYST_CHUNK_CHARS,
+    DIGEST_MAX_CHARS,
+    GEMINI_MODEL_ID,
+    GROQ_MODEL_ID,
+    LLM_CONCURRENCY,
+    RATE_LIMITS,
+    TOKEN_BUDGETS,
+)
+from lib.budget import Section, _cut, fit_sections, report_usage
+from lib.cache import normalize_query
+from lib.checkpoint import Checkpoint
+from lib.chunking import split_markdown
+from lib.dedup import Visited, novelty, shingle_hashes
+from lib.llm_cache import run_limited
+from lib.rank import filter_articles
+from lib.ratelimit import get_limiter
+from lib.readability import limit_markdown
+from lib.utils import (
+    claim_results,
+    get_block_body,
+    output_content,
+    prefetch_topic,
+    send_mail,
+)
 
-learnings: List[str] = []
-insights: List[str] = []
-generated_queries: List[str] = []
-references: List[str] = []
+# min keyword overlap (jaccard) for a prefetched query to stand in for a planned one
+speculation_match = 0.5
 
 system_prompt = dedent("""\
 You are an expert researcher. Follow these instructions when responding:
@@ -46,66 +70,162 @@ class Config(BaseModel):
     format: Literal["md", "pdf"] = Field(
         default="md", description="Output format of the report"
     )
+    width: int = Field(
+        default=1,
+        ge=1,
+        description="Number of queries explored concurrently per depth",
+    )
+    min_novelty: float | None = Field(
+        default=None,
+        ge=0,
+        le=1,
+        description="Stop early when a level's learnings are less novel than this",
+    )
+    pipeline: bool = Field(
+        default=False,
+        description="Prefetch the next depth's candidate queries during analysis",
+    )
+
 
+class ResearchSession:
+    """
+    The state of one research run, checkpointed to `output/sessions/<name>.json`.
+
+    Sessions only share the process wide caches, http pool and rate limiters,
+    so many of them can run concurrently in one process.
+    """
+
+    def __init__(self, c: Config, name: str | None = None):
+        self.config = c
+        self.name = name or f"research{int(time.time())}-{uuid.uuid4().hex[:6]}"
+        self.learnings: List[str] = []
+        # rolling summary of everything learnt so far, bounded by DIGEST_MAX_CHARS
+        self.digest = ""
+        self.generated_queries: List[str] = []
+        self.references: List[str] = []
+        self.visited = Visited()
+        # shingle hashes of every learning so far, to measure the novelty of a level
+        self.known_shingles: set[int] = set()
+        self.checkpoint = Checkpoint(
+            self.name,
+            {"config": c.model_dump(), "depth": 0, "level": None},
+            self.snapshot,
+        )
 
-def summary_learnings(topic: str, max_length: int):
-    if not learnings:
+    @classmethod
+    def resume(cls, name: str) -> "ResearchSession | None":
+        checkpoint = Checkpoint.load(name)
+        if checkpoint is None:
+            return None
+        session = cls(Config.model_validate(checkpoint.data["config"]), name)
+        session.checkpoint.data = checkpoint.data
+        session.restore(checkpoint.data)
+        return session
+
+    def snapshot(self) -> dict:
+        return {
+            "learnings": self.learnings,
+            "digest": self.digest,
+            "generated_queries": self.generated_queries,
+            "references": self.references,
+            "visited": self.visited.dump(),
+            "known_shingles": sorted(self.known_shingles),
+        }
+
+    def restore(self, data: dict) -> None:
+        self.learnings = data.get("learnings", [])
+        # sessions saved before the digest kept a list of insights
+        self.digest = data.get("digest", "\n".join(data.get("insights", [])))
+        self.generated_queries = data.get("generated_queries", [])
+        self.references = data.get("references", [])
+        self.visited.load(data.get("visited", {}))
+        self.known_shingles = set(data.get("known_shingles", []))
+
+
+def summary_learnings(session: ResearchSession, topic: str, max_length: int):
+    if not session.learnings:
         return ""
 
     print("-------summarizing learning-------------->")
-    all_learnings = "\n".join(learnings)
+    all_learnings = "\n".join(session.learnings)
     reader = Agent(
         name="Reader Agent",
         model=Gemini(id=GEMINI_MODEL_ID),
         description="you are an insightful reader and can extract the key points from the text.",
         instructions=[
-            "extract the key points related to the topic from the given text.",
+            "you will be given a digest of what has been learnt so far and some new learnings.",
+            "merge the key points of the new learnings related to the topic into the digest.",
             "don't include the irrelevant information.",
-            "don't miss any important points.",
-            f"the maximum length of the summary is {max_length} characters.",
+            "don't miss any important points, compress the older points if the digest gets too long.",
+            f"the maximum length of the digest is {max_length} characters.",
+            "only return the updated digest.",
         ],
     )
-    insights.append(reader.run(f"Topic:\n{topic}\nLearnings:\n{all_learnings}").content)
-    learnings.clear()
+    # only the bounded digest and this level's learnings are sent, never the history
+    known = f"\nDigest:\n{session.digest}" if session.digest else ""
+    digest = _run_gemini(
+        reader, f"Topic:\n{topic}{known}\nLearnings:\n{all_learnings}"
+    )
+    # the model does not always respect the length, the bound is what keeps the
+    # prompts that carry the digest flat
+    session.digest = _cut(digest, max_length)
+    session.learnings.clear()
 
 
-def plan_research(topic: str, hints: List[str] = []) -> str:
+def plan_research(
+    session: ResearchSession,
+    topic: str,
+    hints: List[str] = [],
+    width: int = 1,
+    record: bool = True,
+) -> List[str]:
     planner = Agent(
         name="Planner Agent",
         model=Groq(id=GROQ_MODEL_ID, temperature=0),
         description=system_prompt,
         instructions=[
-            "you will be given a research topic and some hints, generate a google search query based on them.",
+            f"you will be given a research topic and some hints, generate {width} google search queries based on them.",
             "you will also be given the history of previous queries and what you have learnt.",
             "don't repeat the same or similar queries, try to generate new ones.",
+            "each query should explore a different direction of the topic.",
             "use what you have learnt to inspire you to generate new queries.",
-            "the generated query should be relevant to the topic and the hints, it can be creative but shouldn't be off-topic.",
-            "the generated query should be several keywords for a google search.",
-            "only return the generated query, no other information or explanation.",
+            "the generated queries should be relevant to the topic and the hints, they can be creative but shouldn't be off-topic.",
+            "each generated query should be several keywords for a google search.",
+            "only return the generated queries, one per line, no other information or explanation.",
         ],
     )
     try:
         goal: str = (
-            f"Research Topic:\n{topic}\nWhat I have learnt:\n{','.join(insights)}"
-            if insights
+            f"Research Topic:\n{topic}\nWhat I have learnt:\n{session.digest}"
+            if session.digest
             else f"Research Topic:\n{topic}"
         )
         h: str = f"\nHints:\n{','.join(hints)}" if hints else ""
         history: str = (
-            f"\nOld Query Keywords:\n{','.join(generated_queries)}"
-            if generated_queries
+            f"\nOld Query Keywords:\n{','.join(session.generated_queries)}"
+            if session.generated_queries
             else ""
         )
-        result = planner.run(f"{goal}{h}{history}").content
-        generated_queries.append(result)
+        prompt = f"{goal}{h}{history}"
+        limiter = get_limiter(GROQ_MODEL_ID, **RATE_LIMITS[GROQ_MODEL_ID])
+        result = run_limited(planner, prompt, limiter)
+        queries = [
+            re.sub(r"^\s*(?:[-*]|\d+[.)])\s*", "", line).strip().strip('"')
+            for line in result.splitlines()
+        ]
+        # the same query twice would only be searched and read twice
+        queries = list(dict.fromkeys(q for q in queries if q))[:width]
+        if record:
+            session.generated_queries.extend(queries)
     except Exception as e:
         print(e)
-        result = ""
-    return result
+        queries = []
+    return queries
 
 
-def read_articles(topic: str, articles: List[str], max_length: int):
-    analyst = Agent(
+def _analyst(max_length: int) -> Agent:
+    # agents keep per-run state, so each concurrent call gets its own
+    return Agent(
         name="Analyst Agent",
         model=Gemini(id=GEMINI_MODEL_ID),
         description=system_prompt,
@@ -118,13 +238,89 @@ def read_articles(topic: str, articles: List[str], max_length: int):
         ],
         markdown=True,
     )
-    for article in articles:
+
+
+def _run_gemini(agent: Agent, prompt: str) -> str:
+    limiter = get_limiter(GEMINI_MODEL_ID, **RATE_LIMITS[GEMINI_MODEL_ID])
+    return run_limited(agent, prompt, limiter)
+
+
+def read_article(topic: str, article: str, max_length: int) -> str:
+    if len(article) <= ANALYST_CHUNK_CHARS:
         print("---Reading article-------------->")
-        learnings.append(analyst.run(f"Topic:\n{topic}\nArticles:\n{article}").content)
-        time.sleep(5)
+        return _run_gemini(
+            _analyst(max_length), f"Topic:\n{topic}\nArticles:\n{article}"
+        )
 
+    chunks = split_markdown(article, ANALYST_CHUNK_CHARS)
+    print(f"---Reading article in {len(chunks)} chunks-------------->")
+    with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(chunks))) as pool:
+        notes = list(
+            pool.map(
+                lambda chunk: _run_gemini(
+                    _analyst(max_length), f"Topic:\n{topic}\nArticles:\n{chunk}"
+                ),
+                chunks,
+            )
+        )
+    reducer = Agent(
+        name="Analyst Agent",
+        model=Gemini(id=GEMINI_MODEL_ID),
+        description=system_prompt,
+        instructions=[
+            "you will be given partial reports, each one covers a part of the same article.",
+            "merge them into one mid-report about the research topic.",
+            "keep the citations which are relevant to the topic.",
+            "remove the repeated information.",
+            f"the report should be clear and concise, the whole content should be less than {max_length} characters.",
+        ],
+        markdown=True,
+    )
+    partial = "\n\n".join(notes)
+    return _run_gemini(reducer, f"Topic:\n{topic}\nPartial Reports:\n{partial}")
+
+
+def read_articles(topic: str, articles: List[str], max_length: int) -> List[str]:
+    if not articles:
+        return []
+    with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(articles))) as pool:
+        return list(
+            pool.map(lambda article: read_article(topic, article, max_length), articles)
+        )
+
+
+def research_branch(
+    session: ResearchSession,
+    topic: str,
+    hints: List[str],
+    query: str,
+    breadth: int,
+    branch: dict,
+) -> dict:
+    checkpoint = session.checkpoint
+    if "articles" not in branch:
+        print(f"Searching for: {query}")
+        results = prefetch_topic(query, breadth, session.visited)
+        # claimed and saved together, a sibling's save never stores the claimed
+        # links without this branch's articles
+        with checkpoint.locked():
+            results = claim_results(results, session.visited)
+            checkpoint.update(
+                branch, links=results["links"], articles=results["articles"]
+            )
+    if "learnings" not in branch:
+        articles = [
+            limit_markdown(article)
+            for article in filter_articles(
+                branch["articles"], " ".join([topic, *hints, query])
+            )
+        ]
+        learned = read_articles(topic, articles, 500)
+        checkpoint.update(branch, learnings=learned)
+    return branch
 
-def write_final_report(topic: str, lang: str) -> str:
+
+def write_final_report(session: ResearchSession, topic: str, lang: str) -> str:
     researcher = Agent(
         name="Researcher Agent",
         model=Gemini(id=GEMINI_MODEL_ID),
@@ -174,9 +370,18 @@ def write_final_report(topic: str, lang: str) -> str:
         markdown=True,
         add_datetime_to_instructions=True,
     )
-    return researcher.run(
-        f"Topic:\n{topic}\nMy Learnings:\n{insights}\nReferences:\n{references}"
-    ).content
+    prompt = fit_sections(
+        [
+            Section("Topic", topic, None),
+            Section("My Learnings", session.digest, 1),
+            Section("References", session.references, 0),
+        ],
+        TOKEN_BUDGETS["research_report"],
+        "Researcher Agent",
+    )
+    response = researcher.run(prompt)
+    report_usage("Researcher Agent", prompt, response)
+    return response.content
 
 
 def load_config(config: str) -> Config:
@@ -185,25 +390,144 @@ def load_config(config: str) -> Config:
     return Config.model_validate(json_data)
 
 
-def start_research(config: str):
-    c = load_config(config)
+def _query_similarity(a: str, b: str) -> float:
+    x, y = set(normalize_query(a).split()), set(normalize_query(b).split())
+    return len(x & y) / len(x | y) if x | y else 0.0
+
+
+def _speculate(
+    session: ResearchSession, prefetcher: ThreadPoolExecutor
+) -> dict[str, Future]:
+    c = session.config
+    # planned before this level is summarised, so it may differ from the real plan
+    queries = plan_research(session, c.topic, c.hints, c.width, record=False)
+    for query in queries:
+        print(f"Prefetching candidate query: {query}")
+    return {
+        query: prefetcher.submit(prefetch_topic, query, c.breadth, session.visited)
+        for query in queries
+    }
+
+
+def _adopt_speculation(
+    session: ResearchSession, level: dict, speculative: dict[str, Future]
+) -> None:
+    for plan in level["plans"]:
+        match = max(
+            speculative, key=lambda q: _query_similarity(plan, q), default=None
+        )
+        if match is None or _query_similarity(plan, match) < speculation_match:
+            continue
+        try:
+            results = claim_results(speculative.pop(match).result(), session.visited)
+        except Exception as e:
+            print(f"Prefetch failed for {match}: {e}")
+            continue
+        print(f"Using prefetched results of '{match}' for: {plan}")
+        level["branches"][plan] = results
+    _drop_speculation(speculative)
+
+
+def _drop_speculation(speculative: dict[str, Future]) -> None:
+    for query, future in speculative.items():
+        future.cancel()
+        print(f"Dropping prefetched query: {query}")
+    speculative.clear()
+
+
+def run_research(session: ResearchSession) -> str | None:
+    """
+    Runs (or resumes) a research session and outputs its report.
+
+    Args:
+        session (ResearchSession): the session to run.
+
+    Returns:
+        str | None: the report, None if nothing was learnt.
+    """
+    c = session.config
+    checkpoint = session.checkpoint
+    print(f"Research session: {session.name} (resume with --resume)")
     topic = c.topic
-    for i in range(c.depth):
+    prefetcher = ThreadPoolExecutor(max_workers=c.width) if c.pipeline else None
+    speculative: dict[str, Future] = {}
+    for i in range(checkpoint.data["depth"], c.depth):
         print(f"Researching Depth {i + 1} ---------------->")
-        plan = plan_research(topic, c.hints)
-        if not plan:
+        level = checkpoint.data["level"]
+        if level is None:
+            plans = plan_research(session, topic, c.hints, c.width)
+            level = {"plans": plans, "branches": {}}
+            _adopt_speculation(session, level, speculative)
+            checkpoint.update(level=level)
+        plans = level["plans"]
+        if not plans:
             print("No plan to search for, ignoring this depth.")
+            checkpoint.update(depth=i + 1, level=None)
             continue
-        print(f"Searching for: {plan}")
-        results = search_topic(plan, c.breadth, references)
-        references.extend(results["links"])
-        read_articles(topic, results["articles"], 500)
-        summary_learnings(topic, 250)
+        for plan in plans:
+            level["branches"].setdefault(plan, {})
+        with ThreadPoolExecutor(max_workers=len(plans)) as pool:
+            futures = [
+                pool.submit(
+                    research_branch,
+                    session,
+                    topic,
+                    c.hints,
+                    plan,
+                    c.breadth,
+                    level["branches"][plan],
+                )
+                for plan in plans
+            ]
+            # search and fetch the next depth while this one is being analyzed
+            if prefetcher and i + 1 < c.depth:
+                speculative = _speculate(session, prefetcher)
+            branches = [future.result() for future in futures]
+        # merged in query order once every branch of the level is done
+        for branch in branches:
+            session.references.extend(branch["links"])
+            session.learnings.extend(branch["learnings"])
+        level_novelty = novelty("\n".join(session.learnings), session.known_shingles)
+        for learning in session.learnings:
+            session.known_shingles.update(shingle_hashes(learning))
+        summary_learnings(session, topic, DIGEST_MAX_CHARS)
+        if c.min_novelty is not None and i + 1 < c.depth:
+            print(f"Novelty of depth {i + 1}: {level_novelty:.2f}")
+            if level_novelty < c.min_novelty:
+                skipped = c.depth - i - 1
+                # planner + analysts + summary of every skipped level
+                saved = skipped * (2 + c.width * c.breadth)
+                print(
+                    f"Novelty below {c.min_novelty}, stopping early: skipped "
+                    f"{skipped} depths, about {saved} LLM calls saved."
+                )
+                _drop_speculation(speculative)
+                checkpoint.update(depth=c.depth, level=None)
+                break
+        checkpoint.update(depth=i + 1, level=None)
+    if prefetcher:
+        prefetcher.shutdown(cancel_futures=True)
     print("Generating Final Report ------------------>")
-    if not insights:
+    if not session.digest:
         print("No insights to generate a report, exiting.")
-        return
-    report = get_block_body(write_final_report(topic, c.lang))
-    output_content(topic, c.format, report)
+        return None
+    report = checkpoint.data.get("report")
+    if report is None:
+        report = get_block_body(write_final_report(session, topic, c.lang))
+        checkpoint.update(report=report)
+    # the session suffix keeps concurrent runs on one topic from overwriting
+    output_content(f"{topic}-{session.name}", c.format, report)
     if c.receivers:
         send_mail(topic, c.receivers, report)
+    return report
+
+
+def start_research(config: str | None, resume: str | None = None):
+    if resume:
+        session = ResearchSession.resume(resume)
+        if session is None:
+            print(f"No such research session: {resume}")
+            return
+    else:
+        session = ResearchSession(load_config(config))
+    run_research(session)
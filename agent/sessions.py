@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Literal, Tuple
+
+from agent import research, think, writer
+
+Command = Literal["research", "think", "write"]
+
+_runners: dict[str, Callable[[str], str | None]] = {
+    "research": lambda config: research.run_research(
+        research.ResearchSession(research.load_config(config))
+    ),
+    # a think config may hold many links and modes, their reports are joined
+    "think": lambda config: (
+        "\n\n".join(filter(None, think.deep_think(config))) or None
+    ),
+    "write": lambda config: writer.run_writer(
+        writer.WriterSession(writer.load_config(config))
+    ),
+}
+
+
+def _run(job: Tuple[Command, str]) -> str | None:
+    command, config = job
+    try:
+        return _runners[command](config)
+    except Exception as e:
+        print(f"{command} session for {config} failed: {e}")
+        return None
+
+
+def run_sessions(
+    jobs: List[Tuple[Command, str]], max_workers: int = 4
+) -> List[str | None]:
+    """
+    Runs many research, think and write sessions concurrently in this process.
+
+    Every session keeps its own state, while the http pool, the caches and the
+    per-model rate limiters are shared by all of them.
+
+    Args:
+        jobs (List[Tuple[Command, str]]): the command and config path of each job.
+        max_workers (int): the maximum number of sessions running at once.
+
+    Returns:
+        List[str | None]: the output of each job in order, None if it failed.
+    """
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        return list(pool.map(_run, jobs))
@@ -1,3 +1,31 @@
+import os
+
 GEMINI_MODEL_ID = "gemini-2.5-flash"
 # GEMINI_MODEL_ID = "gemini-2.0-flash"
 GROQ_MODEL_ID = "llama3-8b-8192"
+
+# max concurrent calls to a model, shared by every stage of a run
+LLM_CONCURRENCY = int(os.getenv("TSW_LLM_CONCURRENCY", "4"))
+# requests and tokens per minute allowed for each model
+RATE_LIMITS = {
+    GEMINI_MODEL_ID: {"rpm": 10, "tpm": 250_000, "concurrency": LLM_CONCURRENCY},
+    GROQ_MODEL_ID: {"rpm": 30, "tpm": 30_000, "concurrency": LLM_CONCURRENCY},
+}
+# prompt token budgets of the calls with unbounded inputs
+TOKEN_BUDGETS = {
+    "research_report": int(os.getenv("TSW_BUDGET_RESEARCH_REPORT", "100000")),
+    "writer_draft": int(os.getenv("TSW_BUDGET_WRITER_DRAFT", "100000")),
+    "code_explain": int(os.getenv("TSW_BUDGET_CODE_EXPLAIN", "800000")),
+}
+# articles longer than this are analyzed in chunks and merged (map-reduce)
+ANALYST_CHUNK_CHARS = int(os.getenv("TSW_ANALYST_CHUNK_CHARS", "20000"))
+# size of the rolling research digest, the prompts built on it stay flat with depth
+DIGEST_MAX_CHARS = int(os.getenv("TSW_DIGEST_MAX_CHARS", "2000"))
+# size of the question and answer history sent to the think reader on each loop
+THINK_HISTORY_MAX_CHARS = int(os.getenv("TSW_THINK_HISTORY_MAX_CHARS", "3000"))
+# questions sharing this share of keywords with an asked one are dropped
+QUESTION_SIMILARITY = float(os.getenv("TSW_QUESTION_SIMILARITY", "0.7"))
+# the writer stops revising once a revision changes less than this share of the draft
+REVISION_MIN_CHANGE = float(os.getenv("TSW_REVISION_MIN_CHANGE", "0.05"))
+# articles are translated in sections of this size, all of them concurrently
+TRANSLATION_CHUNK_CHARS = int(os.getenv("TSW_TRANSLATION_CHUNK_CHARS", "4000"))
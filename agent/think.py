@@ -1,5 +1,9 @@
+import itertools
 import json
+import re
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 from typing import List, Literal
 
@@ -7,11 +11,27 @@ from agno.agent import Agent
 from agno.models.google import Gemini
 from pydantic import BaseModel, Field
 
-from agent.settings import GEMINI_MODEL_ID
-from lib.utils import fetch_content_as_md, get_block_body, output_content, send_mail
+from agent.settings import (
+    GEMINI_MODEL_ID,
+    LLM_CONCURRENCY,
+    QUESTION_SIMILARITY,
+    RATE_LIMITS,
+    THINK_HISTORY_MAX_CHARS,
+)
+from lib.context_cache import ContextCache, context_cache
+from lib.dedup import similarity, term_hashes
+from lib.llm_cache import run_limited
+from lib.ratelimit import get_limiter
+from lib.utils import (
+    fetch_content_as_md,
+    fetch_contents_as_md,
+    get_block_body,
+    output_content,
+    send_mail,
+)
 
-question_history: List[str] = []
-thinking_history: List[str] = []
+_list_marker = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s*")
+_sentence_end = re.compile(r"[.!?](?=\s|$)|[\u3002\uff01\uff1f]")
 
 modes = {
     "critical": {
@@ -49,10 +69,13 @@ modes = {
 }
 
 
+Mode = Literal["critical", "faq"]
+
+
 class Config(BaseModel):
-    link: str = Field(description="Link to think about")
-    mode: Literal["critical", "faq"] = Field(
-        default=["critical"], description="thinking mode"
+    link: str | List[str] = Field(description="Link or links to think about")
+    mode: Mode | List[Mode] = Field(
+        default="critical", description="thinking mode or modes, run on every link"
     )
     loops: int = Field(default=5, description="Loops for the thinking")
     lang: str = Field(default="english", description="Language for the report")
@@ -64,51 +87,152 @@ class Config(BaseModel):
     )
 
 
-def ask_questions(article: str, config: Config, max_length: int) -> str:
-    reader = Agent(
-        name="Reader Agent",
-        model=Gemini(id=GEMINI_MODEL_ID),
-        description=modes[config.mode]["reader"],
-        instructions=[
-            f"the whole content should be less than {max_length} characters.",
-            f"the output language: {config.lang}.",
-        ],
-        markdown=True,
-    )
-    prompt: str = (
-        f"Article:\n{article}\nAsked Questions:\n{question_history}\nAnswers to Questions:\n{thinking_history}"
-        if question_history
-        else f"Article:\n{article}"
-    )
-    questions = reader.run(prompt).content
-    question_history.append(questions)
+class ThinkSession:
+    """
+    The question and answer history of one thinking run.
+    """
+
+    def __init__(self, c: Config, name: str | None = None):
+        self.config = c
+        self.name = name or f"{c.mode}{int(time.time())}-{uuid.uuid4().hex[:6]}"
+        self.question_history: List[str] = []
+        self.thinking_history: List[str] = []
+        # every question asked so far, with its keyword hashes for duplicate checks
+        self.asked: List[str] = []
+        self.asked_terms: List[frozenset[int]] = []
+        # the article with the reader and writer prompts, set up once per run
+        self.reader: ContextCache | None = None
+        self.writer: ContextCache | None = None
+
+    def open(self, article: str) -> None:
+        mode = modes[self.config.mode]
+        self.reader = context_cache(
+            GEMINI_MODEL_ID,
+            mode["reader"],
+            _instructions(300, self.config.lang),
+            f"Article:\n{article}",
+        )
+        self.writer = context_cache(
+            GEMINI_MODEL_ID,
+            mode["writer"],
+            _instructions(600, self.config.lang),
+            f"Article:\n{article}",
+        )
+
+    def close(self) -> None:
+        for c in (self.reader, self.writer):
+            if c:
+                c.close()
+        self.reader = self.writer = None
+
+    def history(self) -> str:
+        """
+        Renders a bounded history for the reader: the last answers, a digest
+        of the older answers and the asked questions, each from the newest
+        until its share of the size limit.
+        """
+        if not self.thinking_history:
+            return "No questions asked yet."
+        share = THINK_HISTORY_MAX_CHARS // 3
+        last = (self.thinking_history[-1] or "")[:share]
+        digest = _newest_within(
+            [_gist(answer or "") for answer in self.thinking_history[:-1]], share
+        )
+        asked = _newest_within(
+            self.asked, THINK_HISTORY_MAX_CHARS - len(last) - len(digest)
+        )
+        history = f"Asked Questions:\n{asked}\n"
+        if digest:
+            history += f"Earlier Answers (digest):\n{digest}\n"
+        return f"{history}Last Answers:\n{last}"
+
+    def new_questions(self, questions: str) -> List[str]:
+        """
+        Records the questions not near-duplicates of the asked ones.
+
+        Args:
+            questions (str): the reader output, one question per line.
+
+        Returns:
+            List[str]: the new questions.
+        """
+        new: List[str] = []
+        for line in questions.splitlines():
+            question = _list_marker.sub("", line).strip()
+            if not question:
+                continue
+            terms = term_hashes(question)
+            if any(
+                similarity(terms, asked) >= QUESTION_SIMILARITY
+                for asked in self.asked_terms
+            ):
+                print(f"Skipping a repeated question: {question}")
+                continue
+            self.asked.append(question)
+            self.asked_terms.append(terms)
+            new.append(question)
+        return new
+
+
+def _gist(answer: str, max_chars: int = 200) -> str:
+    # the first sentence of an answer, where it usually states its point
+    text = " ".join(_list_marker.sub("", line) for line in answer.split("\n"))
+    text = " ".join(text.split())
+    end = _sentence_end.search(text, 0, max_chars)
+    return text[: end.end() if end else max_chars]
+
+
+def _newest_within(items: List[str], max_chars: int) -> str:
+    # a bullet list of the newest items fitting in max_chars, oldest first
+    kept: List[str] = []
+    size = 0
+    for item in reversed(items):
+        size += len(item) + 3
+        if size > max_chars:
+            break
+        kept.append(f"- {item}")
+    return "\n".join(reversed(kept))
+
+
+def _instructions(max_length: int, lang: str) -> List[str]:
+    return [
+        f"the whole content should be less than {max_length} characters.",
+        f"the output language: {lang}.",
+    ]
+
+
+def _run_gemini(agent: Agent, prompt: str) -> str:
+    # every session of a batch shares the model limiter
+    limiter = get_limiter(GEMINI_MODEL_ID, **RATE_LIMITS[GEMINI_MODEL_ID])
+    return run_limited(agent, prompt, limiter)
+
+
+def ask_questions(session: ThinkSession) -> str:
+    # the history is bounded, so the prompt stays flat however many loops run
+    reader = session.reader.agent("Reader Agent")
+    output = _run_gemini(reader, session.reader.prompt(session.history())) or ""
+    new = session.new_questions(output)
+    if not new:
+        return ""
+    questions = "\n".join(f"{i}. {q}" for i, q in enumerate(new, 1))
+    session.question_history.append(questions)
     return questions
 
 
-def answer_questions(
-    article: str, question: str, config: Config, max_length: int
-) -> str:
-    writer = Agent(
-        name="writer Agent",
-        model=Gemini(id=GEMINI_MODEL_ID),
-        description=modes[config.mode]["writer"],
-        instructions=[
-            f"the whole content should be less than {max_length} characters.",
-            f"the output language: {config.lang}.",
-        ],
-        markdown=True,
-    )
-    prompt: str = f"Article:\n{article}\nQuestions:\n{question}"
-    answers = writer.run(prompt).content
-    thinking_history.append(answers)
+def answer_questions(session: ThinkSession, question: str) -> str:
+    writer = session.writer.agent("writer Agent")
+    answers = _run_gemini(writer, session.writer.prompt(f"Questions:\n{question}"))
+    session.thinking_history.append(answers)
     return answers
 
 
-def output_thinking() -> str:
+def output_thinking(session: ThinkSession) -> str:
     return "\n".join(
         [
             f"## Question:\n\n {question}\n\n## Answer: \n\n{answer}"
-            for question, answer in zip(question_history, thinking_history)
+            for question, answer in zip(
+                session.question_history, session.thinking_history
+            )
         ]
     )
 
@@ -127,7 +251,7 @@ def format_thinking(content: str, config: Config) -> str:
         ],
         markdown=True,
     )
-    return formatter.run(content).content
+    return _run_gemini(formatter, content)
 
 
 def load_config(config: str) -> Config:
@@ -136,34 +260,97 @@ def load_config(config: str) -> Config:
     return Config.model_validate(json_data)
 
 
-def deep_think(config: str):
-    c = load_config(config)
+def run_think(session: ThinkSession, article: str | None = None) -> str | None:
+    """
+    Runs the question and answer loops of a session and outputs its report.
+
+    Args:
+        session (ThinkSession): the session to run, on a single link and mode.
+        article (str | None): the content of the link, fetched if not given.
+
+    Returns:
+        str | None: the report, None if the link or the loops gave nothing.
+    """
+    c = session.config
     link = c.link
-    article = fetch_content_as_md(link)
+    article = article or fetch_content_as_md(link)
     if not article:
         print(f"Failed to fetch the content from {link}, exiting.")
-        return
+        return None
 
-    for i in range(c.loops):
-        print(f"Thinking Loop {i + 1} ---------------->")
-        questions = ask_questions(article, c, 300)
-        if not questions:
-            print("No more questions, exiting.")
-            break
+    session.open(article)
+    try:
+        for i in range(c.loops):
+            print(f"Thinking Loop {i + 1} ---------------->")
+            questions = ask_questions(session)
+            if not questions:
+                print("No more questions, exiting.")
+                break
 
-        answers = answer_questions(article, questions, c, 600)
+            answer_questions(session, questions)
+    finally:
+        session.close()
 
     print("Outputing ------------------>")
-    if not questions or not answers:
+    # a loop without new questions only ends the run, the earlier ones are kept
+    if not session.question_history or not any(session.thinking_history):
         print("No questions or answers to output, exiting.")
-        return
+        return None
 
-    content = output_thinking()
+    content = output_thinking(session)
 
     print("Formatting ------------------>")
     content = get_block_body(format_thinking(content, c))
     content = f"# Thinking(Mode: {c.mode}) on {link}\n\n{content}"
-    topic = f"{c.mode}{int(time.time())}"
-    output_content(topic, c.format, content)
+    output_content(session.name, c.format, content)
     if c.receivers:
-        send_mail(topic, c.receivers, content)
+        send_mail(session.name, c.receivers, content)
+    return content
+
+
+def run_batch(c: Config) -> List[str | None]:
+    """
+    Thinks about every link in every mode of a config.
+
+    Each link is fetched once, then its sessions, one per mode, run
+    concurrently and share the model rate limit.
+
+    Args:
+        c (Config): the config, with one or many links and modes.
+
+    Returns:
+        List[str | None]: the report of each (link, mode) pair, links first.
+    """
+    links = [c.link] if isinstance(c.link, str) else list(dict.fromkeys(c.link))
+    mode_list = [c.mode] if isinstance(c.mode, str) else list(dict.fromkeys(c.mode))
+    if not links or not mode_list:
+        print("No links or no modes to think about.")
+        return []
+    articles = dict(zip(links, fetch_contents_as_md(links)))
+    jobs = [
+        (ThinkSession(c.model_copy(update={"link": link, "mode": mode})), link)
+        for link, mode in itertools.product(links, mode_list)
+    ]
+    if len(jobs) == 1:
+        session, link = jobs[0]
+        return [run_think(session, articles[link])]
+
+    def run(job: tuple[ThinkSession, str]) -> str | None:
+        session, link = job
+        if not articles[link]:
+            print(f"Failed to fetch the content from {link}, skipping.")
+            return None
+        try:
+            return run_think(session, articles[link])
+        except Exception as e:
+            print(f"Thinking on {link} ({session.config.mode}) failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(jobs))) as pool:
+        reports = list(pool.map(run, jobs))
+    print(f"{sum(1 for r in reports if r)} of {len(jobs)} reports written.")
+    return reports
+
+
+def deep_think(config: str) -> List[str | None]:
+    return run_batch(load_config(config))
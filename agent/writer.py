@@ -1,5 +1,9 @@
+import difflib
 import json
+import re
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 from typing import List, Literal
 
@@ -7,12 +11,42 @@ from agno.agent import Agent
 from agno.models.google import Gemini
 from pydantic import BaseModel, Field
 
-from agent.settings import GEMINI_MODEL_ID
+from agent.settings import (
+    GEMINI_MODEL_ID,
+    LLM_CONCURRENCY,
+    RATE_LIMITS,
+    REVISION_MIN_CHANGE,
+    TOKEN_BUDGETS,
+    TRANSLATION_CHUNK_CHARS,
+)
+from lib.budget import Section, fit_sections, report_usage
+from lib.chunking import split_markdown
+from lib.dedup import Visited
+from lib.llm_cache import run_limited
+from lib.masking import mask, missing_placeholders, unmask
+from lib.rank import filter_articles
+from lib.ratelimit import get_limiter
+from lib.readability import limit_markdown
 from lib.utils import output_content, read, search_topic
 
 MAX_REVISIONS = 5
+# the editor's answer when the draft needs no more changes
+APPROVAL = "LGTM"
+
+_actions = re.compile(
+    r"\b(add|remove|delete|clarify|expand|elaborate|explain|fix|correct|include|"
+    r"rephrase|rewrite|reword|shorten|condense|simplify|restructure|reorganize|"
+    r"replace|split|merge|cite|define|provide|mention|cover|update|improve|"
+    r"reduce|avoid|consider|should|must|needs?|missing|lacks?|unclear|"
+    r"inaccurate|incorrect|wrong)\b",
+    re.I,
+)
+_approvals = re.compile(
+    r"\b(good|great|excellent|well[- ]written|clear|ready|solid|"
+    r"no (?:further )?changes)\b",
+    re.I,
+)
 
-reference_history = []
 expected_output = dedent("""\
     A professional technical article in markdown format:
 
@@ -47,9 +81,21 @@ class Config(BaseModel):
     )
 
 
-def write_draft(agenda: str, tags: List[str] = []) -> str:
-    results = search_topic(",".join(tags), 3, reference_history)
-    reference_history.extend(results["links"])
+class WriterSession:
+    """
+    The references gathered by one writing run.
+    """
+
+    def __init__(self, c: Config, name: str | None = None):
+        self.config = c
+        self.name = name or f"article{int(time.time())}-{uuid.uuid4().hex[:6]}"
+        self.reference_history: List[str] = []
+        self.visited = Visited()
+
+
+def write_draft(session: WriterSession, agenda: str, tags: List[str] = []) -> str:
+    results = search_topic(",".join(tags), 3, session.visited)
+    session.reference_history.extend(results["links"])
     writer = Agent(
         name="Writer Agent",
         model=Gemini(id=GEMINI_MODEL_ID),
@@ -63,9 +109,28 @@ def write_draft(agenda: str, tags: List[str] = []) -> str:
         expected_output=expected_output,
         markdown=True,
     )
-    return writer.run(
-        f"Agenda:\n{agenda}\nTags:\n{','.join(tags)}\nReference Document:\n{results['articles']}\nReferences Links:\n{reference_history}"
-    ).content
+    prompt = fit_sections(
+        [
+            Section("Agenda", agenda, None),
+            Section("Tags", ",".join(tags), None),
+            Section(
+                "Reference Document",
+                [
+                    limit_markdown(article)
+                    for article in filter_articles(
+                        results["articles"], " ".join([agenda, *tags])
+                    )
+                ],
+                1,
+            ),
+            Section("References Links", session.reference_history, 0),
+        ],
+        TOKEN_BUDGETS["writer_draft"],
+        "Writer Agent",
+    )
+    response = writer.run(prompt)
+    report_usage("Writer Agent", prompt, response)
+    return response.content
 
 
 def revise_draft(draft: str, feedback: str) -> str:
@@ -92,12 +157,103 @@ def review_draft(draft: str) -> str:
             "given a draft of an article, read it and give feedback to improve its quality, readability and accuracy.",
             "only return your feedback, no other information or explanation.",
             "the feedback should be less than 200 characters",
+            f"if the draft needs no more changes, only return {APPROVAL}.",
         ],
         markdown=True,
     )
     return editor.run(draft).content
 
 
+def translate_section(section: str, lang: str) -> str:
+    translator = Agent(
+        name="Translator Agent",
+        model=Gemini(id=GEMINI_MODEL_ID),
+        description="You are a professional technical translator.",
+        instructions=[
+            f"translate the given part of a markdown article into {lang}.",
+            "keep the markdown structure, the technical terms and the abbreviations.",
+            "keep every placeholder like ⟦0⟧ exactly as it is, don't translate, move or drop it.",
+            "only return the translation, no other information or explanation.",
+        ],
+        markdown=True,
+    )
+    limiter = get_limiter(GEMINI_MODEL_ID, **RATE_LIMITS[GEMINI_MODEL_ID])
+    return run_limited(translator, section, limiter)
+
+
+def translate_article(session: WriterSession, article: str) -> dict[str, str]:
+    """
+    Translates the article into every configured language at once.
+
+    Code blocks, inline code and link targets are masked before the article
+    is split into sections, so they are never sent to the model. The sections
+    of all the languages are translated concurrently.
+
+    Args:
+        session (WriterSession): the session, its config lists the languages.
+        article (str): the final article.
+
+    Returns:
+        dict[str, str]: the translations by language, failed ones are left out.
+    """
+    langs = list(dict.fromkeys(session.config.tranlations))
+    if not langs or not article.strip():
+        return {}
+    masked, placeholders = mask(article)
+    sections = split_markdown(masked, TRANSLATION_CHUNK_CHARS)
+    if not sections:
+        return {}
+    jobs = [(lang, section) for lang in langs for section in sections]
+    print(f"Translating {len(sections)} sections into {', '.join(langs)}")
+
+    def translate(job: tuple[str, str]) -> str | None:
+        lang, section = job
+        try:
+            translated = translate_section(section, lang)
+        except Exception as e:
+            print(f"Failed to translate a section into {lang}: {e}")
+            return None
+        keys = [key for key in placeholders if key in section]
+        missing = missing_placeholders(translated or "", keys)
+        if not translated or missing:
+            # keep the original section rather than lose code or links
+            print(f"A {lang} section lost its code or links, keeping the original")
+            return section
+        return translated
+
+    with ThreadPoolExecutor(max_workers=min(LLM_CONCURRENCY, len(jobs))) as pool:
+        results = list(pool.map(translate, jobs))
+
+    translations: dict[str, str] = {}
+    for i, lang in enumerate(langs):
+        parts = results[i * len(sections) : (i + 1) * len(sections)]
+        if None in parts:
+            print(f"Skipping the {lang} translation, some sections failed.")
+            continue
+        translations[lang] = unmask("\n\n".join(parts), placeholders)
+    return translations
+
+
+def _actionable(feedback: str) -> bool:
+    """
+    Whether the editor feedback asks for any change, feedback that only
+    praises the draft is not actionable.
+    """
+    if not feedback or feedback.strip().strip(".!").upper() == APPROVAL:
+        return False
+    return bool(_actions.search(feedback)) or not _approvals.search(feedback)
+
+
+def _change_ratio(before: str, after: str) -> float:
+    """
+    The normalized word level edit distance of two drafts, from 0 to 1.
+    """
+    a, b = before.split(), after.split()
+    if not a and not b:
+        return 0.0
+    return 1 - difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
 def load_config(config: str | None) -> Config:
     if config is None:
         return Config()
@@ -106,20 +262,49 @@ def load_config(config: str | None) -> Config:
     return Config.model_validate(json_data)
 
 
-def write_article(config: str):
-    c = load_config(config)
+def run_writer(session: WriterSession) -> str:
+    """
+    Writes, reviews and revises the article of a session and outputs it.
+
+    Args:
+        session (WriterSession): the session to run.
+
+    Returns:
+        str: the final article.
+    """
+    c = session.config
     agenda = read(c.agenda)
     print("Writing Draft ------------------>")
-    draft = write_draft(agenda, c.tags)
+    draft = write_draft(session, agenda, c.tags)
+    # each revision is one review and one revise call
+    calls = 0
     for i in range(c.revisions):
         print(f"Reviewing Draft: {i + 1} ------------------>")
         feedback = review_draft(draft)
-        if not feedback:
-            print("No feedback received. Article is ready.")
+        calls += 1
+        if not _actionable(feedback):
+            print("No actionable feedback received. Article is ready.")
             break
-        draft = revise_draft(draft, feedback)
+        revised = revise_draft(draft, feedback) or draft
+        calls += 1
+        change = _change_ratio(draft, revised)
+        draft = revised
+        print(f"Revision {i + 1} changed {change:.1%} of the draft.")
+        if change < REVISION_MIN_CHANGE:
+            print("The draft has converged. Article is ready.")
+            break
+    if calls < 2 * c.revisions:
+        print(f"Stopped early, avoided {2 * c.revisions - calls} LLM calls.")
     print("Saving ------------------>")
-    topic = f"article{int(time.time())}"
-    output_content(topic, c.format, draft)
+    output_content(session.name, c.format, draft)
+    if c.tranlations:
+        print("Translating ------------------>")
+        for lang, translation in translate_article(session, draft).items():
+            output_content(f"{session.name}-{lang}", c.format, translation)
     # if c.receivers:
-    #     send_mail(topic, c.receivers, draft)
+    #     send_mail(session.name, c.receivers, draft)
+    return draft
+
+
+def write_article(config: str):
+    run_writer(WriterSession(load_config(config)))
@@ -3,29 +3,56 @@ import sys
 import typer
 from dotenv import load_dotenv
 
-from agent.aggregate import aggregate_sources
-from agent.code import explain_repo, pack_repo
-from agent.kb import generate_kb_entry, list_kb_entries, remove_kb_entry
-from agent.research import start_research
-from agent.summary import generate_summary
-from agent.think import deep_think
-from agent.writer import write_article
-
+# the TSW_* settings are read on import, so .env must be loaded first
 load_dotenv()
 
+from agent.aggregate import aggregate_sources  # noqa: E402
+from agent.code import explain_repo, pack_repo  # noqa: E402
+from agent.kb import generate_kb_entry, list_kb_entries, remove_kb_entry  # noqa: E402
+from agent.research import start_research  # noqa: E402
+from agent.summary import generate_summary  # noqa: E402
+from agent.think import deep_think  # noqa: E402
+from agent.writer import write_article  # noqa: E402
+from lib import cache, llm_cache  # noqa: E402
+
 app = typer.Typer(help="a command line interface for your tiny smart workers.")
 kb_app = typer.Typer(help="Commands related to the knowledge base.")
 code_app = typer.Typer(help="Commands related to the coding.")
+cache_app = typer.Typer(help="Commands related to the on-disk caches.")
+
+
+@app.callback()
+def options(
+    ctx: typer.Context,
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="bypass all on-disk caches"
+    ),
+    use_llm_cache: bool = typer.Option(
+        None,
+        "--llm-cache/--no-llm-cache",
+        help="cache agent responses, defaults to TSW_LLM_CACHE_COMMANDS",
+        show_default=False,
+    ),
+):
+    if no_cache:
+        cache.disable()
+    if use_llm_cache is None:
+        use_llm_cache = ctx.invoked_subcommand in llm_cache.llm_cache_commands
+    if use_llm_cache:
+        llm_cache.install()
 
 
 @app.command()
 def research(
-    config: str = typer.Argument(..., help="config file path"),
+    config: str = typer.Argument(None, help="config file path"),
+    resume: str = typer.Option(None, help="research session to resume"),
 ):
     """
     Generate a deep research report for a given topic.
     """
-    start_research(config)
+    if config is None and resume is None:
+        raise typer.BadParameter("either a config file or --resume is required")
+    start_research(config, resume)
 
 
 @app.command()
@@ -33,7 +60,7 @@ def think(
     config: str = typer.Argument(..., help="config file path"),
 ):
     """
-    Deeply think about a given link.
+    Deeply think about the given links, in every given mode.
     """
     deep_think(config)
 
@@ -131,14 +158,33 @@ def pack(
     pack_repo(config)
 
 
+@cache_app.command()
+def info():
+    """
+    Show the size of each on-disk cache.
+    """
+    cache.list_caches()
+
+
+@cache_app.command()
+def purge(
+    name: str = typer.Argument(None, help="cache name, all caches if omitted"),
+):
+    """
+    Remove the entries of an on-disk cache.
+    """
+    cache.purge_caches(name)
+
+
 app.add_typer(kb_app, name="kb")
 app.add_typer(code_app, name="code")
+app.add_typer(cache_app, name="cache")
 
 
 def main():
     if len(sys.argv) == 1:
         sys.argv.append("--help")
-    elif len(sys.argv) == 2 and sys.argv[1] in ["kb", "code"]:
+    elif len(sys.argv) == 2 and sys.argv[1] in ["kb", "code", "cache"]:
         sys.argv.append("--help")
     app()
 
@@ -0,0 +1,114 @@
+from typing import List
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the tokens of a text without a tokenizer.
+
+    Latin text averages about 4 characters per token, while CJK and other
+    non-ascii characters are mostly a token each.
+
+    Args:
+        text (str): the text.
+
+    Returns:
+        int: the estimated token count.
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def _cut(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    return text[: cut if cut > max_chars // 2 else max_chars]
+
+
+class Section:
+    """
+    A part of a prompt, rendered as `title:\ncontent`, or as the bare content
+    when the title is None.
+
+    Sections with `priority` None are never trimmed, the others are trimmed
+    from the lowest priority up. A list content is ranked, its last items are
+    dropped whole, and only a lone multi-line item (a document) is cut.
+    """
+
+    def __init__(
+        self, title: str | None, content: str | List[str], priority: int | None
+    ):
+        self.title = title
+        self.content = content
+        self.priority = priority
+
+    def render(self) -> str:
+        content = (
+            "\n".join(self.content) if isinstance(self.content, list) else self.content
+        )
+        return content if self.title is None else f"{self.title}:\n{content}"
+
+    def shrink(self, ratio: float) -> None:
+        if isinstance(self.content, list):
+            target = int(sum(len(item) + 1 for item in self.content) * ratio)
+            kept: List[str] = []
+            size = 0
+            for item in self.content:
+                if size + len(item) + 1 > target:
+                    break
+                kept.append(item)
+                size += len(item) + 1
+            if not kept and self.content and "\n" in self.content[0]:
+                # a cut url or title is useless, a cut document still helps
+                kept = [_cut(self.content[0], target)]
+            self.content = [item for item in kept if item]
+        else:
+            self.content = _cut(self.content, int(len(self.content) * ratio))
+
+
+def fit_sections(sections: List[Section], budget: int, label: str) -> str:
+    """
+    Renders the sections into a prompt within the token budget.
+
+    Args:
+        sections (List[Section]): the prompt sections in output order.
+        budget (int): the maximum prompt tokens.
+        label (str): the name of the call, used for logging.
+
+    Returns:
+        str: the prompt.
+    """
+    total = sum(estimate_tokens(s.render()) for s in sections)
+    if total > budget:
+        print(f"{label}: ~{total} prompt tokens over the budget of {budget}, trimming")
+    trimmable = sorted(
+        (s for s in sections if s.priority is not None), key=lambda s: s.priority
+    )
+    for section in trimmable:
+        over = total - budget
+        if over <= 0:
+            break
+        tokens = estimate_tokens(section.render())
+        section.shrink(max(tokens - over, 0) / tokens if tokens else 0)
+        total += estimate_tokens(section.render()) - tokens
+    return "\n".join(s.render() for s in sections)
+
+
+def report_usage(label: str, prompt: str, response) -> None:
+    """
+    Prints the estimated prompt tokens next to the tokens the model reported.
+
+    Args:
+        label (str): the name of the call.
+        prompt (str): the prompt sent.
+        response (RunResponse): the agent response.
+    """
+    metrics = getattr(response, "metrics", None) or {}
+    actual = metrics.get("input_tokens", 0)
+    # agno keeps one value per model message
+    if isinstance(actual, list):
+        actual = sum(actual)
+    print(
+        f"{label}: estimated {estimate_tokens(prompt)} prompt tokens, "
+        f"actual {actual or 'n/a'}"
+    )
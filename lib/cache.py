@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+cache_dir = os.getenv("TSW_CACHE_DIR", os.path.join("output", ".cache"))
+
+# turned off by the `--no-cache` cli option
+enabled = True
+
+# every DiskCache created in the process, by namespace
+caches: dict[str, "DiskCache"] = {}
+
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a url so that trivially different spellings share one cache entry.
+
+    Args:
+        url (str): the url to normalize.
+
+    Returns:
+        str: lower-cased scheme and host, no default port, no fragment and sorted query.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not (
+        (scheme == "http" and parts.port == 80)
+        or (scheme == "https" and parts.port == 443)
+    ):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+_query_stopwords = {"a", "an", "and", "the", "of", "for", "in", "on", "to", "with"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query so near-identical queries share one cache entry.
+
+    Args:
+        query (str): the search query.
+
+    Returns:
+        str: the lower-cased, de-duplicated and sorted keywords without stopwords.
+    """
+    words = re.findall(r"[^\W_]+(?:[-.][^\W_]+)*[+#]*", query.lower())
+    return " ".join(sorted({w for w in words if w not in _query_stopwords}))
+
+
+class DiskCache:
+    """
+    A size-bounded LRU cache on disk, one json file per entry.
+
+    Reading an entry refreshes its mtime, the least recently used entries are
+    evicted once the namespace grows over `max_bytes`.
+    """
+
+    def __init__(self, namespace: str, max_bytes: int, ttl: float | None = None):
+        self.dir = os.path.join(cache_dir, namespace)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        caches[namespace] = self
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.dir, f"{digest}.json")
+
+    def is_fresh(self, entry: dict) -> bool:
+        return self.ttl is None or time.time() - entry["created"] < self.ttl
+
+    def get(self, key: str, stale: bool = False) -> dict | None:
+        """
+        Gets the data stored for the key.
+
+        Args:
+            key (str): the cache key.
+            stale (bool): return the entry even if its ttl is expired.
+
+        Returns:
+            dict | None: the entry with `created` and `data`, None if missing.
+        """
+        if not enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key or (not stale and not self.is_fresh(entry)):
+            return None
+        return entry
+
+    def set(self, key: str, data: dict, evict: bool = True) -> None:
+        if not enabled:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "created": time.time(), "data": data}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Failed to write cache entry for {key}: {e}")
+            return
+        if evict:
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _files(self) -> list[tuple[str, os.stat_result]]:
+        if not os.path.isdir(self.dir):
+            return []
+        files = []
+        for name in os.listdir(self.dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                files.append((path, os.stat(path)))
+            except FileNotFoundError:
+                continue
+        return files
+
+    def evict(self) -> None:
+        with self._lock:
+            files = self._files()
+            total = sum(stat.st_size for _, stat in files)
+            for path, stat in sorted(files, key=lambda f: f[1].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= stat.st_size
+
+    def clear(self) -> int:
+        files = self._files()
+        for path, _ in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(files)
+
+    def stats(self) -> dict:
+        files = self._files()
+        return {
+            "entries": len(files),
+            "bytes": sum(stat.st_size for _, stat in files),
+            "max_bytes": self.max_bytes,
+        }
+
+
+def list_caches() -> str:
+    lines = []
+    for name, c in sorted(caches.items()):
+        stats = c.stats()
+        lines.append(
+            f"{name}: {stats['entries']} entries, "
+            f"{stats['bytes'] / 1024 / 1024:.1f}MB of {c.max_bytes / 1024 / 1024:.0f}MB"
+        )
+    entries = "\n".join(lines)
+    print(entries)
+    return entries
+
+
+def purge_caches(name: str | None = None) -> None:
+    if name is not None and name not in caches:
+        print(f"No such cache: {name}, choose from {', '.join(sorted(caches))}")
+        return
+    for n, c in sorted(caches.items()):
+        if name is None or n == name:
+            print(f"{n}: removed {c.clear()} entries")
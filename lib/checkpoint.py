@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+sessions_dir = os.getenv("TSW_SESSIONS_DIR", os.path.join("output", "sessions"))
+
+
+class Checkpoint:
+    """
+    The durable state of a session, rewritten to `<sessions_dir>/<name>.json`
+    after every completed stage.
+
+    `snapshot` is called on each save to collect the state kept outside of
+    `data`, its result is merged into `data` before writing.
+    """
+
+    def __init__(
+        self, name: str, data: dict, snapshot: Callable[[], dict] | None = None
+    ):
+        self.name = name
+        self.data = data
+        self.snapshot = snapshot
+        self.path = os.path.join(sessions_dir, f"{name}.json")
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, name: str) -> "Checkpoint | None":
+        path = os.path.join(sessions_dir, f"{name}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(name, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds off the saves of other threads, so state changed outside of
+        `data` is never saved without the update that records it.
+        """
+        with self._lock:
+            yield
+
+    def update(self, target: dict | None = None, **values) -> None:
+        """
+        Updates `target` (the top level data by default) and saves the session.
+
+        Args:
+            target (dict | None): a dict nested in `data`.
+            values: the values to set.
+        """
+        with self._lock:
+            (self.data if target is None else target).update(values)
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            if self.snapshot:
+                self.data.update(self.snapshot())
+            os.makedirs(sessions_dir, exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
@@ -0,0 +1,68 @@
+import re
+from typing import List
+
+from lib.masking import _close, _open
+
+_heading = re.compile(r"^#{1,6}\s", re.M)
+
+
+def _cut_point(paragraph: str, max_chars: int) -> int:
+    # a masked text must never be cut inside one of its placeholders
+    start = paragraph.rfind(_open, 0, max_chars)
+    if start > 0 and paragraph.find(_close, start, max_chars) == -1:
+        return start
+    return max_chars
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    parts: List[str] = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            cut = _cut_point(paragraph, max_chars)
+            parts.append(paragraph[:cut])
+            paragraph = paragraph[cut:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_markdown(text: str, max_chars: int) -> List[str]:
+    """
+    Splits markdown on its headings into chunks of at most `max_chars`.
+
+    Consecutive small sections are packed into one chunk, sections longer
+    than `max_chars` are split on paragraphs.
+
+    Args:
+        text (str): the markdown.
+        max_chars (int): the maximum length of a chunk.
+
+    Returns:
+        List[str]: the chunks in document order.
+    """
+    starts = [m.start() for m in _heading.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    chunks: List[str] = []
+    current = ""
+    for section in sections:
+        if len(section) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_split_long(section, max_chars))
+        elif len(current) + len(section) > max_chars:
+            chunks.append(current)
+            current = section
+        else:
+            current += section
+    if current:
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from typing import List
+
+from agno.agent import Agent
+from agno.models.google import Gemini
+
+from lib.budget import estimate_tokens
+
+# "gemini" stores long prefixes with the provider, "local" always resends them
+context_cache_backend = os.getenv("TSW_CONTEXT_CACHE", "gemini")
+# shorter prefixes are sent inline, the provider refuses small caches
+context_cache_min_tokens = int(os.getenv("TSW_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+# seconds a provider cache lives if it is not deleted at the end of the run
+context_cache_ttl = int(os.getenv("TSW_CONTEXT_CACHE_TTL", "3600"))
+
+# provider cache name -> digest of its content, keeps response cache keys stable
+_digests: dict[str, str] = {}
+
+
+class ContextCache:
+    """
+    A system prompt and a long content (an article) shared by many calls.
+
+    This is the local stand-in, it resends the content inline with every
+    prompt. `GeminiContextCache` uploads it once instead.
+    """
+
+    def __init__(
+        self, model_id: str, description: str, instructions: List[str], content: str
+    ):
+        self.model_id = model_id
+        self.description = description
+        self.instructions = instructions
+        self.content = content
+        self.digest = hashlib.sha256(
+            json.dumps([model_id, description, instructions, content]).encode()
+        ).hexdigest()
+
+    def agent(self, name: str) -> Agent:
+        return Agent(
+            name=name,
+            model=Gemini(id=self.model_id),
+            description=self.description,
+            instructions=self.instructions,
+            markdown=True,
+        )
+
+    def prompt(self, delta: str) -> str:
+        return f"{self.content}\n{delta}"
+
+    def close(self) -> None:
+        pass
+
+
+class GeminiContextCache(ContextCache):
+    """
+    Keeps the system prompt and the content in a Gemini cached content, calls
+    reference it by name so only their own prompt is sent and billed in full.
+    """
+
+    def __init__(
+        self, model_id: str, description: str, instructions: List[str], content: str
+    ):
+        from google import genai
+        from google.genai import types
+
+        super().__init__(model_id, description, instructions, content)
+        self._client = genai.Client()
+        system = "\n".join(
+            [description, *instructions, "Use markdown to format your answers."]
+        )
+        self.name = self._client.caches.create(
+            model=model_id,
+            config=types.CreateCachedContentConfig(
+                display_name=f"tsw-{self.digest[:16]}",
+                system_instruction=system,
+                contents=[content],
+                ttl=f"{context_cache_ttl}s",
+            ),
+        ).name
+        _digests[self.name] = self.digest
+
+    def agent(self, name: str) -> Agent:
+        # the system prompt lives in the cache, gemini rejects requests that set it again
+        return Agent(
+            name=name,
+            model=Gemini(
+                id=self.model_id, generation_config={"cached_content": self.name}
+            ),
+            create_default_system_message=False,
+        )
+
+    def prompt(self, delta: str) -> str:
+        return delta
+
+    def close(self) -> None:
+        try:
+            self._client.caches.delete(name=self.name)
+        except Exception as e:
+            print(f"Failed to delete the context cache {self.name}: {e}")
+        _digests.pop(self.name, None)
+
+
+def context_cache(
+    model_id: str, description: str, instructions: List[str], content: str
+) -> ContextCache:
+    """
+    Creates a context cache for a content reused by many calls.
+
+    The provider cache is used when it is enabled and the content is long
+    enough, otherwise, or when creating it fails, the local stand-in.
+
+    Args:
+        model_id (str): the gemini model.
+        description (str): the agent description.
+        instructions (List[str]): the agent instructions.
+        content (str): the shared content, sent before every prompt.
+
+    Returns:
+        ContextCache: the cache, close it once the calls are done.
+    """
+    if (
+        context_cache_backend == "gemini"
+        and estimate_tokens(content) >= context_cache_min_tokens
+    ):
+        try:
+            return GeminiContextCache(model_id, description, instructions, content)
+        except Exception as e:
+            print(f"Failed to create a context cache, sending the content inline: {e}")
+    return ContextCache(model_id, description, instructions, content)
+
+
+def cached_digest(agent) -> str | None:
+    """
+    Returns the digest of the cached content an agent refers to, if any.
+    """
+    config = getattr(agent.model, "generation_config", None)
+    if not isinstance(config, dict):
+        return None
+    return _digests.get(config.get("cached_content"))
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import re
+import threading
+import zlib
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lib.cache import normalize_url
+from lib.rank import tokenize
+
+# max differing simhash bits for two articles to count as near-duplicates
+simhash_distance = int(os.getenv("TSW_SIMHASH_DISTANCE", "3"))
+# texts with fewer shingles are too short to fingerprint reliably
+min_shingles = 20
+
+_tracking_params = re.compile(
+    r"^(utm_\w+|gclid|dclid|fbclid|msclkid|yclid|igshid|mc_cid|mc_eid|_ga|_gl|"
+    r"ref|ref_src|ref_url|source|spm|share|si)$",
+    re.I,
+)
+
+
+def canonical_url(url: str) -> str:
+    """
+    Canonicalizes a url so mirrors of the same link compare equal.
+
+    Args:
+        url (str): the url.
+
+    Returns:
+        str: https, no `www.`, no tracking params and no trailing slash.
+    """
+    parts = urlsplit(normalize_url(url))
+    host = parts.netloc.removeprefix("www.")
+    query = urlencode(
+        [(k, v) for k, v in parse_qsl(parts.query) if not _tracking_params.match(k)]
+    )
+    path = parts.path.rstrip("/")
+    scheme = "https" if parts.scheme == "http" else parts.scheme
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    words = re.findall(r"\w+", text.lower())
+    return [" ".join(words[i : i + size]) for i in range(len(words) - size + 1)]
+
+
+def shingle_hashes(text: str) -> set[int]:
+    return {zlib.crc32(s.encode()) for s in shingles(text)}
+
+
+def novelty(text: str, known: set[int]) -> float:
+    """
+    Measures how much of a text is new compared to the shingles already seen.
+
+    Args:
+        text (str): the new text.
+        known (set[int]): the shingle hashes of the texts seen before.
+
+    Returns:
+        float: the share of the text's shingles not in `known`, from 0 to 1.
+    """
+    hashes = shingle_hashes(text)
+    if not hashes:
+        return 0.0
+    return len(hashes - known) / len(hashes)
+
+
+def term_hashes(text: str) -> frozenset[int]:
+    """
+    Hashes the keywords of a short text (a question, a query), stopwords are
+    dropped, plurals folded and CJK is split per character.
+    """
+    terms = (
+        t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t
+        for t in tokenize(text)
+    )
+    return frozenset(zlib.crc32(t.encode()) for t in terms)
+
+
+def similarity(a: frozenset[int], b: frozenset[int]) -> float:
+    """
+    The jaccard similarity of two sets of term hashes, from 0 to 1.
+    """
+    return len(a & b) / len(a | b) if a | b else 0.0
+
+
+def simhash(text: str) -> int | None:
+    """
+    Computes a 64-bit simhash over the word 3-shingles of the text.
+
+    Args:
+        text (str): the text.
+
+    Returns:
+        int | None: the fingerprint, None if the text is too short.
+    """
+    features = shingles(text)
+    if len(features) < min_shingles:
+        return None
+    weights = [0] * 64
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest())
+        for i in range(64):
+            weights[i] += 1 if h >> i & 1 else -1
+    return sum(1 << i for i, w in enumerate(weights) if w > 0)
+
+
+class Visited:
+    """
+    Links and article fingerprints already seen by a run.
+
+    Links are compared by their canonical url. Article fingerprints are indexed
+    by `max_distance + 1` bands (at most 64), any two fingerprints within
+    `max_distance` bits differ in fewer bands than that and so share one.
+    """
+
+    def __init__(self, max_distance: int = simhash_distance):
+        self.max_distance = max_distance
+        bands = min(max(max_distance + 1, 1), 64)
+        # bit offsets of the bands, uneven when 64 does not split evenly
+        self._band_edges = [64 * b // bands for b in range(bands + 1)]
+        self.links: set[str] = set()
+        self._fingerprints: list[int] = []
+        self._buckets: dict[tuple[int, int], list[int]] = {}
+        self._lock = threading.Lock()
+
+    def has_link(self, link: str) -> bool:
+        return canonical_url(link) in self.links
+
+    def add_link(self, link: str) -> bool:
+        """
+        Records a link.
+
+        Args:
+            link (str): the link.
+
+        Returns:
+            bool: False if the link was already visited.
+        """
+        url = canonical_url(link)
+        with self._lock:
+            if url in self.links:
+                return False
+            self.links.add(url)
+        return True
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {
+                "links": sorted(self.links),
+                "fingerprints": list(self._fingerprints),
+            }
+
+    def load(self, data: dict) -> None:
+        """
+        Restores the links and fingerprints of a `dump`.
+        """
+        with self._lock:
+            self.links = set(data.get("links", []))
+            self._fingerprints = []
+            self._buckets = {}
+        for fingerprint in data.get("fingerprints", []):
+            self._add_fingerprint(fingerprint)
+
+    def _band_keys(self, fingerprint: int) -> List[tuple[int, int]]:
+        edges = self._band_edges
+        return [
+            (b, fingerprint >> start & (1 << end - start) - 1)
+            for b, (start, end) in enumerate(zip(edges, edges[1:]))
+        ]
+
+    def add_content(self, text: str) -> bool:
+        """
+        Records the fingerprint of an article.
+
+        Args:
+            text (str): the article.
+
+        Returns:
+            bool: False if a near-duplicate article was already seen.
+        """
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return True
+        return self._add_fingerprint(fingerprint)
+
+    def _add_fingerprint(self, fingerprint: int) -> bool:
+        keys = self._band_keys(fingerprint)
+        with self._lock:
+            for key in keys:
+                for i in self._buckets.get(key, []):
+                    other = self._fingerprints[i]
+                    if (fingerprint ^ other).bit_count() <= self.max_distance:
+                        return False
+            self._fingerprints.append(fingerprint)
+            for key in keys:
+                self._buckets.setdefault(key, []).append(len(self._fingerprints) - 1)
+        return True
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from lib import cache
+from lib.budget import estimate_tokens
+
+# commands whose agent responses are cached, the cli can override it per run
+llm_cache_commands = os.getenv(
+    "TSW_LLM_CACHE_COMMANDS", "research,think,write,summarise,code"
+).split(",")
+
+
+class ResponseCache:
+    """
+    A sqlite backed cache of agent responses with a ttl and a size bound.
+
+    The least recently read responses are evicted once the stored content
+    grows over `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float | None = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        cache.caches["llm"] = self
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, content TEXT, "
+                "size INTEGER, created REAL, accessed REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT content, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            content, created = row
+            if self.ttl is not None and time.time() - created >= self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            db.commit()
+            return content
+
+    def set(self, key: str, model: str, content: str) -> None:
+        now = time.time()
+        size = len(content.encode())
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, content, size, now, now),
+            )
+            total = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall()
+                for k, s in rows:
+                    if total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM responses WHERE key = ?", (k,))
+                    total -= s
+            db.commit()
+
+    def clear(self) -> int:
+        with self._lock:
+            db = self._db()
+            count = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            db.execute("DELETE FROM responses")
+            db.commit()
+            db.execute("VACUUM")
+            return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = (
+                self._db()
+                .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+                .fetchone()
+            )
+        return {"entries": count, "bytes": size, "max_bytes": self.max_bytes}
+
+
+_installed: ResponseCache | None = None
+
+response_cache = ResponseCache(
+    os.path.join(cache.cache_dir, "llm.sqlite3"),
+    max_bytes=int(os.getenv("TSW_LLM_CACHE_MAX_MB", "128")) * 1024 * 1024,
+    ttl=float(os.getenv("TSW_LLM_CACHE_TTL", "86400")),
+)
+
+
+def response_key(agent, message: str) -> str:
+    """
+    Hashes everything that shapes an agent response.
+
+    Args:
+        agent (Agent): the agent.
+        message (str): the prompt.
+
+    Returns:
+        str: the sha256 of the model id, description, instructions,
+            expected output, cached context and prompt.
+    """
+    from lib.context_cache import cached_digest
+
+    parts = [
+        agent.model.id if agent.model else None,
+        agent.description,
+        agent.instructions,
+        agent.expected_output,
+        message,
+    ]
+    digest = cached_digest(agent)
+    if digest:
+        parts.insert(-1, digest)
+    payload = json.dumps(
+        parts,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def install(c: ResponseCache = response_cache) -> None:
+    """
+    Routes every non-streaming `Agent.run` with a text prompt through the cache.
+    """
+    from agno.agent import Agent, RunResponse
+
+    global _installed
+    run = Agent.run
+    if getattr(run, "_response_cached", False):
+        return
+    _installed = c
+
+    @wraps(run)
+    def cached_run(self, message=None, *args, **kwargs):
+        if (
+            not cache.enabled
+            or not isinstance(message, str)
+            or args
+            or kwargs.get("stream")
+        ):
+            return run(self, message, *args, **kwargs)
+        key = response_key(self, message)
+        content = c.get(key)
+        if content is not None:
+            print(f"Using cached response for {self.name}")
+            return RunResponse(content=content)
+        response = run(self, message, **kwargs)
+        if isinstance(response.content, str) and response.content:
+            c.set(key, self.model.id if self.model else "", response.content)
+        return response
+
+    cached_run._response_cached = True
+    Agent.run = cached_run
+
+
+def lookup(agent, message: str) -> str | None:
+    """
+    Returns the cached response of an agent call without running it.
+
+    Args:
+        agent (Agent): the agent.
+        message (str): the prompt.
+
+    Returns:
+        str | None: the response, None if it is not cached or caching is off.
+    """
+    if _installed is None or not cache.enabled:
+        return None
+    content = _installed.get(response_key(agent, message))
+    if content is not None:
+        print(f"Using cached response for {agent.name}")
+    return content
+
+
+def run_limited(agent, message: str, limiter) -> str:
+    """
+    Runs an agent within a rate limiter, cached responses skip the limiter so
+    a cached rerun is not throttled.
+
+    Args:
+        agent (Agent): the agent.
+        message (str): the prompt.
+        limiter (RateLimiter): the limiter of the agent's model.
+
+    Returns:
+        str: the response content.
+    """
+    content = lookup(agent, message)
+    if content is not None:
+        return content
+    with limiter.limit(estimate_tokens(message)):
+        return agent.run(message).content
@@ -0,0 +1,48 @@
+import re
+from typing import Dict, List, Tuple
+
+_open, _close = "⟦", "⟧"
+_fence = re.compile(r"^(```|~~~)[^\n]*\n.*?^\1[ \t]*$", re.M | re.S)
+_inline_code = re.compile(r"`[^`\n]+`")
+_link_target = re.compile(r"(?<=\])\([^)\s]+(?:\s+\"[^\"]*\")?\)")
+_autolink = re.compile(r"<https?://[^>\s]+>")
+_url = re.compile(r"https?://[^\s)\]>]+")
+_placeholder = re.compile(rf"{_open}(\d+){_close}")
+
+
+def mask(text: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Replaces the code blocks, inline code and link targets of a markdown text
+    with placeholders, so they are never sent to a model.
+
+    Args:
+        text (str): the markdown.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: the masked text, and the placeholders with
+            the text they replace.
+    """
+    masked: Dict[str, str] = {}
+
+    def replace(match: re.Match) -> str:
+        key = f"{_open}{len(masked)}{_close}"
+        masked[key] = match.group(0)
+        return key
+
+    for pattern in (_fence, _inline_code, _link_target, _autolink, _url):
+        text = pattern.sub(replace, text)
+    return text, masked
+
+
+def unmask(text: str, masked: Dict[str, str]) -> str:
+    """
+    Puts back the text replaced by `mask`.
+    """
+    return _placeholder.sub(lambda m: masked.get(m.group(0), m.group(0)), text)
+
+
+def missing_placeholders(text: str, expected: List[str]) -> List[str]:
+    """
+    Lists the placeholders of `expected` that are not in the text.
+    """
+    return [key for key in expected if key not in text]
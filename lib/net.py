@@ -0,0 +1,54 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+pool_connections = int(os.getenv("TSW_HTTP_POOL_CONNECTIONS", "16"))
+pool_maxsize = int(os.getenv("TSW_HTTP_POOL_MAXSIZE", "16"))
+max_retries = int(os.getenv("TSW_HTTP_RETRIES", "3"))
+backoff_factor = float(os.getenv("TSW_HTTP_BACKOFF", "0.5"))
+
+_sessions: dict[str, requests.Session] = {}
+_session_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    # ACCEPT_ENCODING only advertises br when a brotli decoder is installed
+    s.headers.update({"User-Agent": "Mozilla/5.0", "Accept-Encoding": ACCEPT_ENCODING})
+    return s
+
+
+def session(name: str = "default") -> requests.Session:
+    """
+    Returns a process wide keep-alive session shared by all lib network helpers.
+
+    Args:
+        name (str): clients that change their session's headers or proxies get
+            their own named session, so the change stays out of the others.
+
+    Returns:
+        requests.Session: a pooled session retrying 429/5xx with exponential backoff.
+    """
+    with _session_lock:
+        if name not in _sessions:
+            _sessions[name] = _create_session()
+        return _sessions[name]
@@ -4,7 +4,7 @@ import base64
 import json
 import zlib
 
-import requests
+from lib.net import session
 
 
 def _js_string_to_byte(data):
@@ -36,5 +36,5 @@ def generate_pako_link(graphMarkdown: str):
 
 
 def generate_image_dataurl(link: str):
-    r = requests.get(link)
+    r = session().get(link)
     return f"data:image/png;base64,{base64.b64encode(r.content).decode()}"
@@ -0,0 +1,123 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import pymupdf
+import pymupdf4llm
+
+from lib.cache import DiskCache
+
+pdf_workers = int(os.getenv("TSW_PDF_WORKERS", str(os.cpu_count() or 1)))
+# pages per shard sent to a worker process
+pdf_shard_pages = int(os.getenv("TSW_PDF_SHARD_PAGES", "16"))
+# documents with more pages are extracted as plain text instead of markdown
+pdf_fast_pages = int(os.getenv("TSW_PDF_FAST_PAGES", "200"))
+
+page_cache = DiskCache(
+    "pdf_pages",
+    max_bytes=int(os.getenv("TSW_PDF_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # one pool for the whole process, however many fetch threads extract pdfs,
+    # spawned since forking a multi-threaded process can deadlock
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=pdf_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def file_sha256(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _extract_pages(file: str, pages: List[int], fast: bool) -> List[str]:
+    if fast:
+        with pymupdf.open(file) as doc:
+            return [doc[i].get_text() for i in pages]
+    chunks = pymupdf4llm.to_markdown(file, pages=pages, page_chunks=True)
+    return [chunk["text"] for chunk in chunks]
+
+
+def extract_pdf(file: str, fast: bool | None = None) -> str:
+    """
+    Extracts a pdf page by page, sharding page ranges over a process pool.
+
+    Pages already extracted from a file with the same sha256 are read from the
+    page cache, so only the missing pages are processed.
+
+    Args:
+        file (str): path of the pdf.
+        fast (bool | None): plain text instead of markdown, None picks it by page count.
+
+    Returns:
+        str: the pages merged in order.
+    """
+    digest = file_sha256(file)
+    with pymupdf.open(file) as doc:
+        page_count = doc.page_count
+    if fast is None:
+        fast = page_count > pdf_fast_pages
+    mode = "text" if fast else "md"
+
+    texts: List[str | None] = []
+    for i in range(page_count):
+        entry = page_cache.get(f"{digest}:{mode}:{i}")
+        texts.append(entry["data"]["text"] if entry else None)
+
+    missing = [i for i, text in enumerate(texts) if text is None]
+    shards = [
+        missing[i : i + pdf_shard_pages]
+        for i in range(0, len(missing), pdf_shard_pages)
+    ]
+    results = None
+    if len(shards) > 1 and pdf_workers > 1:
+        pool = _get_pool()
+        try:
+            results = list(
+                pool.map(
+                    _extract_pages,
+                    [file] * len(shards),
+                    shards,
+                    [fast] * len(shards),
+                )
+            )
+        except BrokenProcessPool as e:
+            print(f"The pdf worker pool broke, extracting in process: {e}")
+            _reset_pool(pool)
+    if results is None:
+        results = [_extract_pages(file, shard, fast) for shard in shards]
+
+    for shard, pages in zip(shards, results):
+        for i, text in zip(shard, pages):
+            texts[i] = text
+            page_cache.set(f"{digest}:{mode}:{i}", {"text": text}, evict=False)
+    if missing:
+        page_cache.evict()
+
+    return ("\n" if fast else "").join(texts)
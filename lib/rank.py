@@ -0,0 +1,174 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import List
+
+# passages kept per article, 0 turns the filter off
+passage_top_k = int(os.getenv("TSW_PASSAGE_TOP_K", "20"))
+# characters kept per article, keep it between TSW_ANALYST_CHUNK_CHARS (so long
+# articles are still analyzed chunk by chunk) and TSW_ARTICLE_MAX_CHARS
+passage_max_chars = int(os.getenv("TSW_PASSAGE_MAX_CHARS", "30000"))
+# longer paragraphs are split on lines, then sentences
+passage_split_chars = 1500
+
+_token = re.compile(r"[^\W_]+", re.U)
+_cjk = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_sentence_end = re.compile(r"(?<=[.!?\u3002\uff01\uff1f])\s*")
+_stopwords = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "why", "will", "with",
+}  # fmt: skip
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in _token.findall(text.lower()):
+        if _cjk.search(word):
+            # no word boundaries in CJK, index each character instead
+            tokens.extend(ch for ch in word if not ch.isspace())
+        elif word not in _stopwords:
+            tokens.append(word)
+    return tokens
+
+
+class BM25:
+    """
+    Okapi BM25 over a small in-memory corpus.
+    """
+
+    def __init__(self, docs: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(doc)) for doc in docs]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.docs) if self.docs else 0
+        df = Counter(term for doc in self.docs for term in doc)
+        n = len(self.docs)
+        self.idf = {t: math.log((n - f + 0.5) / (f + 0.5) + 1) for t, f in df.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = set(tokenize(query))
+        result = []
+        for doc, length in zip(self.docs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            result.append(
+                sum(
+                    self.idf[t] * doc[t] * (self.k1 + 1) / (doc[t] + norm)
+                    for t in terms
+                    if t in doc
+                )
+            )
+        return result
+
+
+def _pack(pieces: List[str], sep: str, max_chars: int) -> List[str]:
+    packed: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(sep) + len(piece) > max_chars:
+            packed.append(current)
+            current = ""
+        current = f"{current}{sep}{piece}" if current else piece
+    if current:
+        packed.append(current)
+    return packed
+
+
+def _split_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    # transcripts and pdf text often have no blank lines at all
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    pieces: List[str] = []
+    for line in paragraph.split("\n"):
+        if len(line) <= max_chars:
+            pieces.append(line)
+            continue
+        for sentence in _sentence_end.split(line):
+            pieces.extend(
+                sentence[i : i + max_chars] for i in range(0, len(sentence), max_chars)
+            )
+    return _pack([p for p in pieces if p.strip()], "\n", max_chars)
+
+
+def passages(
+    article: str, min_chars: int = 80, max_chars: int = passage_split_chars
+) -> List[str]:
+    """
+    Splits an article into paragraphs, short ones (headings, captions) are
+    joined to the next paragraph so they keep their context, long ones are
+    split on lines, then sentences, to at most `max_chars`.
+    """
+    result: List[str] = []
+    pending = ""
+    for paragraph in (
+        part
+        for block in re.split(r"\n\s*\n", article)
+        for part in _split_paragraph(block.strip(), max_chars)
+    ):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        paragraph = f"{pending}\n{paragraph}" if pending else paragraph
+        if len(paragraph) < min_chars:
+            pending = paragraph
+            continue
+        result.append(paragraph)
+        pending = ""
+    if pending:
+        result.append(pending)
+    return result
+
+
+def filter_articles(
+    articles: List[str],
+    query: str,
+    top_k: int = passage_top_k,
+    max_chars: int = passage_max_chars,
+) -> List[str]:
+    """
+    Keeps the passages of each article most relevant to the query.
+
+    Passages are scored with BM25 over the passages of all the articles, the
+    top `top_k` of each article are kept within `max_chars`, in their original
+    order. Short articles are filtered too, only their matching passages stay.
+
+    Args:
+        articles (List[str]): the articles.
+        query (str): the topic, hints and query text.
+        top_k (int): passages kept per article, 0 keeps everything.
+        max_chars (int): characters kept per article.
+
+    Returns:
+        List[str]: the filtered articles.
+    """
+    if top_k <= 0:
+        return articles
+    split = [passages(article) for article in articles]
+    scores = BM25([p for ps in split for p in ps]).scores(query)
+
+    result: List[str] = []
+    offset = 0
+    for article, ps in zip(articles, split):
+        article_scores = scores[offset : offset + len(ps)]
+        offset += len(ps)
+        ranked = sorted(range(len(ps)), key=lambda i: article_scores[i], reverse=True)
+        ranked = [i for i in ranked if article_scores[i] > 0]
+        if not ranked:
+            # nothing matches the query, fall back to the beginning of the article
+            ranked = list(range(len(ps)))
+        kept: List[int] = []
+        size = 0
+        for i in ranked[:top_k]:
+            # two more characters for the blank line joining the passages
+            if size + len(ps[i]) > max_chars:
+                continue
+            kept.append(i)
+            size += len(ps[i]) + 2
+        if not kept:
+            # never return less than the head of the article
+            result.append(article[:max_chars])
+            continue
+        result.append("\n\n".join(ps[i] for i in sorted(kept)))
+    return result
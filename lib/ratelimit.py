@@ -0,0 +1,79 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled continuously at `per_second`.
+    """
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        # a request larger than the bucket would never fit, it just drains it
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.per_second
+                )
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.per_second
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute, tokens-per-minute and concurrency budget of one model.
+    """
+
+    def __init__(self, rpm: int, tpm: int, concurrency: int):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Blocks until the model has budget for one request of the given size.
+
+        Args:
+            tokens (int): the estimated prompt tokens of the request.
+        """
+        self.requests.acquire()
+        self.tokens.acquire(tokens)
+
+    @contextmanager
+    def limit(self, tokens: int):
+        """
+        Holds one of the concurrent call slots of the model and its rate budget.
+
+        Args:
+            tokens (int): the estimated prompt tokens of the request.
+        """
+        with self.slots:
+            self.acquire(tokens)
+            yield
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model_id: str, rpm: int, tpm: int, concurrency: int) -> RateLimiter:
+    """
+    Returns the limiter shared by every caller of the model in this process.
+    """
+    with _limiters_lock:
+        if model_id not in _limiters:
+            _limiters[model_id] = RateLimiter(rpm, tpm, concurrency)
+        return _limiters[model_id]
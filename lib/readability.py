@@ -0,0 +1,148 @@
+# A small readability-style boilerplate stripper, the scoring follows the
+# classic arc90 readability heuristics:
+# https://github.com/mozilla/readability/blob/main/Readability.js
+import os
+import re
+
+from bs4 import BeautifulSoup, Tag
+
+# raw html beyond this is dropped before parsing
+html_max_chars = int(os.getenv("TSW_HTML_MAX_CHARS", "2000000"))
+# markdown handed to the agents is cut at this many characters
+article_max_chars = int(os.getenv("TSW_ARTICLE_MAX_CHARS", "40000"))
+# the main content candidate must hold at least this much text
+min_content_chars = 250
+
+_junk_tags = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "iframe",
+    "svg",
+    "canvas",
+    "button",
+    "input",
+    "select",
+    "textarea",
+    "nav",
+    "footer",
+    "aside",
+    "link",
+    "meta",
+]
+_junk_roles = {"navigation", "banner", "contentinfo", "complementary", "dialog"}
+_junk_pattern = re.compile(
+    r"cookie|consent|gdpr|newsletter|subscribe|share|social|sidebar|comment|"
+    r"related|advert|sponsor|promo|popup|modal|breadcrumb|footer|menu|navbar",
+    re.I,
+)
+# class or id hints of content, these nodes are never removed by the pattern
+_content_pattern = re.compile(r"article|body|content|main|post|entry|column", re.I)
+_keep_tags = {"html", "body", "main", "article"}
+
+
+def _attrs(el: Tag) -> str:
+    return " ".join(el.get("class") or []) + " " + (el.get("id") or "")
+
+
+def _is_junk(el: Tag, page_chars: int) -> bool:
+    if el.name in _keep_tags:
+        return False
+    if el.get("role") in _junk_roles or el.get("aria-hidden") == "true":
+        return True
+    attrs = _attrs(el)
+    # forms are search boxes and sign ups, unless they wrap the page (asp.net)
+    if el.name != "form" and (
+        not _junk_pattern.search(attrs) or _content_pattern.search(attrs)
+    ):
+        return False
+    # a layout wrapper like "comments-enabled" may hold the whole article
+    if el.find(["article", "main"]) or el.find(attrs={"role": "main"}):
+        return False
+    return len(el.get_text(strip=True)) < page_chars / 2
+
+
+def _link_density(el: Tag) -> float:
+    text = len(el.get_text(strip=True))
+    if not text:
+        return 1.0
+    links = sum(len(a.get_text(strip=True)) for a in el.find_all("a"))
+    return links / text
+
+
+def _best_candidate(root: Tag) -> Tag:
+    articles = root.find_all("article")
+    if articles:
+        best = max(articles, key=lambda a: len(a.get_text(strip=True)))
+        if len(best.get_text(strip=True)) >= min_content_chars:
+            return best
+
+    scores: dict[int, tuple[Tag, float]] = {}
+    for p in root.find_all(["p", "pre", "td", "blockquote"]):
+        text = p.get_text(strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        parent = p.parent
+        grandparent = parent.parent if parent is not root else None
+        for node, weight in ((parent, 1.0), (grandparent, 0.5)):
+            if isinstance(node, Tag):
+                _, total = scores.get(id(node), (node, 0.0))
+                scores[id(node)] = (node, total + score * weight)
+
+    if not scores:
+        return root
+    best, _ = max(
+        scores.values(), key=lambda item: item[1] * (1 - _link_density(item[0]))
+    )
+    if len(best.get_text(strip=True)) < min_content_chars:
+        return root
+    return best
+
+
+def extract_main_content(html: str) -> str:
+    """
+    Strips navigation, scripts, cookie banners and other boilerplate from a page.
+
+    Args:
+        html (str): the raw html.
+
+    Returns:
+        str: the html of the main content block, the cleaned body if none is found.
+    """
+    soup = BeautifulSoup(html[:html_max_chars], "html.parser")
+    for el in soup.find_all(_junk_tags):
+        el.decompose()
+    page_chars = len(soup.get_text(strip=True))
+    for el in [el for el in soup.find_all(True) if _is_junk(el, page_chars)]:
+        if not el.decomposed:
+            el.decompose()
+
+    root = soup.find("main") or soup.find(attrs={"role": "main"}) or soup.body or soup
+    return str(_best_candidate(root))
+
+
+def clean_markdown(text: str) -> str:
+    """
+    Collapses the runs of blank lines left by the stripped boilerplate.
+    """
+    return re.sub(r"\n\s*\n(\s*\n)+", "\n\n", text).strip()
+
+
+def limit_markdown(text: str, max_chars: int = article_max_chars) -> str:
+    """
+    Collapses blank lines and cuts the markdown at a paragraph boundary.
+
+    Args:
+        text (str): the markdown.
+        max_chars (int): the maximum length of the result.
+
+    Returns:
+        str: the limited markdown.
+    """
+    text = clean_markdown(text)
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n\n", 0, max_chars)
+    return text[: cut if cut > max_chars // 2 else max_chars]
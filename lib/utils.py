@@ -1,18 +1,58 @@
+import hashlib
 import os
-from typing import List
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from urllib.parse import urlparse
 
 import markdown
-import pymupdf4llm
-import requests
 import resend
 from googlesearch import search
 from markdown_pdf import MarkdownPdf, Section
 from markdownify import markdownify as md
+from requests import Response
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from lib.cache import DiskCache, normalize_query, normalize_url
+from lib.dedup import Visited
+from lib.net import session
+from lib.pdf import extract_pdf
+from lib.readability import clean_markdown, extract_main_content
+
 output_dir = "output"
 os.makedirs(output_dir, exist_ok=True)
 
+# concurrency caps for fetching search results
+fetch_concurrency = int(os.getenv("TSW_FETCH_CONCURRENCY", "8"))
+fetch_per_host = int(os.getenv("TSW_FETCH_PER_HOST", "2"))
+
+# downloads bigger than this are dropped instead of being extracted
+pdf_max_bytes = int(os.getenv("TSW_PDF_MAX_MB", "50")) * 1024 * 1024
+download_chunk_size = 64 * 1024
+
+http_cache = DiskCache(
+    "http",
+    max_bytes=int(os.getenv("TSW_HTTP_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=float(os.getenv("TSW_HTTP_CACHE_TTL", "86400")),
+)
+
+search_cache = DiskCache(
+    "search",
+    max_bytes=int(os.getenv("TSW_SEARCH_CACHE_MAX_MB", "16")) * 1024 * 1024,
+    ttl=float(os.getenv("TSW_SEARCH_CACHE_TTL", "604800")),
+)
+
+# extracted text of pdfs and youtube transcripts
+text_cache = DiskCache(
+    "text", max_bytes=int(os.getenv("TSW_TEXT_CACHE_MAX_MB", "256")) * 1024 * 1024
+)
+
+_fetch_slots = threading.BoundedSemaphore(fetch_concurrency)
+_search_lock = threading.Lock()
+_host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+_host_semaphores_lock = threading.Lock()
+
 
 def generate_pdf(name: str, markdown: str) -> None:
     """
@@ -54,25 +94,65 @@ def exist(file: str) -> bool:
 
 
 def extract_text_from_pdf(file: str) -> str:
-    md_text = pymupdf4llm.to_markdown(file)
-    return md_text
-
-
-def extract_text_from_youtube(video_id: str) -> str:
-    ytt_api = YouTubeTranscriptApi()
-    transcript = ytt_api.fetch(video_id, ["en", "zh"])
+    # extract_pdf caches every page by the file hash, no need to store it twice
+    return extract_pdf(file)
+
+
+def extract_text_from_youtube(
+    video_id: str, languages: Tuple[str, ...] = ("en", "zh")
+) -> str:
+    key = f"youtube:{video_id}:{','.join(languages)}"
+    entry = text_cache.get(key)
+    if entry:
+        return entry["data"]["text"]
+    # the transcript api sets its own headers and proxies on the session
+    ytt_api = YouTubeTranscriptApi(http_client=session("youtube"))
+    transcript = ytt_api.fetch(video_id, list(languages))
     text = "\n".join([snippet.text for snippet in transcript])
+    text_cache.set(key, {"source": video_id, "text": text})
     return text
 
 
-def download(link: str, filename: str) -> None:
-    r = requests.get(link)
-    with open(f"{output_dir}/{filename}", "wb") as f:
-        f.write(r.content)
+def save_stream(
+    r: Response, suffix: str, max_bytes: int = pdf_max_bytes
+) -> str | None:
+    """
+    Streams a response body to the output dir in chunks, named by its sha256.
 
+    Args:
+        r (Response): a response opened with `stream=True`.
+        suffix (str): file suffix, e.g. ".pdf".
+        max_bytes (int): abort the download when the body is bigger than this.
 
-def filename(file: str) -> str:
-    return ".".join(os.path.basename(file).split(".")[0:-1])
+    Returns:
+        str | None: the saved file path, None if the body is too large.
+    """
+    length = r.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        print(f"Skipping {r.url}: {length} bytes exceeds the limit of {max_bytes}")
+        return None
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=output_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in r.iter_content(chunk_size=download_chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    print(f"Skipping {r.url}: body exceeds the limit of {max_bytes}")
+                    return None
+                digest.update(chunk)
+                f.write(chunk)
+        path = f"{output_dir}/{digest.hexdigest()}{suffix}"
+        if exist(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+        return path
+    finally:
+        if exist(tmp):
+            os.remove(tmp)
 
 
 def clean_repomix_output(file: str) -> str:
@@ -110,26 +190,129 @@ def send_mail(topic: str, receivers: List[str], content: str):
 
 
 def search_topic(
-    topic: str, num_results=10, visited_links: List[str] = []
+    topic: str, num_results=10, visited: Visited | None = None
 ) -> List[dict]:
+    if visited is None:
+        visited = Visited()
+    result = search_links(topic, num_results)
+    links: List[str] = []
+    for link in result:
+        if not visited.add_link(link):
+            print(f"Skipping already visited link: {link}")
+            continue
+        links.append(link)
+    return _new_contents(links, fetch_contents_as_md(links), visited)
+
+
+def prefetch_topic(topic: str, num_results: int, visited: Visited) -> dict:
+    """
+    Searches and fetches a topic without recording anything in `visited`, so
+    speculative results can be dropped. Use `claim_results` to adopt them.
+
+    Args:
+        topic (str): the search query.
+        num_results (int): the number of links to search.
+        visited (Visited): links already visited are not fetched.
+
+    Returns:
+        dict: the `links` and their `articles`, None for failed fetches.
+    """
+    links = [
+        link for link in search_links(topic, num_results) if not visited.has_link(link)
+    ]
+    return {"links": links, "articles": fetch_contents_as_md(links)}
+
+
+def claim_results(results: dict, visited: Visited) -> dict:
+    links, contents = [], []
+    for link, content in zip(results["links"], results["articles"]):
+        if not visited.add_link(link):
+            print(f"Skipping already visited link: {link}")
+            continue
+        links.append(link)
+        contents.append(content)
+    return _new_contents(links, contents, visited)
+
+
+def _new_contents(
+    links: List[str], contents: List[str | None], visited: Visited
+) -> dict:
     results: dict = {
         "links": [],
         "articles": [],
     }
-    result = search(topic, num_results=num_results, unique=True, sleep_interval=1)
-    for link in result:
-        if link in visited_links:
-            print(f"Skipping already visited link: {link}")
+    for link, content in zip(links, contents):
+        if not content:
             continue
-
-        print(f"Fetching content from {link}")
-        content = fetch_content_as_md(link)
-        if content:
-            results["links"].append(link)
-            results["articles"].append(content)
+        if not visited.add_content(content):
+            print(f"Skipping near-duplicate content from: {link}")
+            continue
+        results["links"].append(link)
+        results["articles"].append(content)
     return results
 
 
+def search_links(query: str, num_results=10) -> List[str]:
+    """
+    Searches google for the query, reusing the results of an equivalent query.
+
+    Args:
+        query (str): the search query.
+        num_results (int): the number of links to return.
+
+    Returns:
+        List[str]: the result links in rank order.
+    """
+    key = normalize_query(query) or query
+    entry = search_cache.get(key)
+    if entry and entry["data"]["num_results"] >= num_results:
+        print(f"Using cached search results for: {query}")
+        return entry["data"]["links"][:num_results]
+
+    # concurrent searches would only get us blocked sooner
+    with _search_lock:
+        links = list(
+            search(query, num_results=num_results, unique=True, sleep_interval=1)
+        )
+    search_cache.set(key, {"query": query, "num_results": num_results, "links": links})
+    return links
+
+
+def fetch_contents_as_md(
+    urls: List[str], max_workers: int = fetch_concurrency
+) -> List[str | None]:
+    """
+    Fetches the given urls concurrently, keeping the order of the input.
+
+    Args:
+        urls (List[str]): urls to fetch.
+        max_workers (int): cap of the concurrent fetches of this call, the
+            whole process never runs more than `fetch_concurrency`.
+
+    Returns:
+        List[str | None]: the markdown content for each url, None if it failed.
+    """
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return list(executor.map(_fetch_with_host_limit, urls))
+
+
+def _host_semaphore(url: str) -> threading.BoundedSemaphore:
+    host = urlparse(url).netloc.lower()
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(fetch_per_host)
+        return _host_semaphores[host]
+
+
+def _fetch_with_host_limit(url: str) -> str | None:
+    # host first, a fetch waiting on a busy host must not hold a global slot
+    with _host_semaphore(url), _fetch_slots:
+        print(f"Fetching content from {url}")
+        return fetch_content_as_md(url)
+
+
 def fetch_content_as_md(url: str) -> str | None:
     try:
         if url.startswith("https://www.youtube.com/watch?v="):
@@ -137,35 +320,57 @@ def fetch_content_as_md(url: str) -> str | None:
             content = extract_text_from_youtube(video_id)
             return md(content)
 
-        r = requests.get(url, timeout=5, headers={"User-Agent": "Mozilla/5.0"})
-        if r.status_code != 200:
-            print(f"Failed to fetch content from {url}")
+        key = normalize_url(url)
+        cached = http_cache.get(key, stale=True)
+        if cached and http_cache.is_fresh(cached):
+            return cached["data"]["content"]
+
+        headers = {}
+        if cached and cached["data"].get("etag"):
+            headers["If-None-Match"] = cached["data"]["etag"]
+        if cached and cached["data"].get("last_modified"):
+            headers["If-Modified-Since"] = cached["data"]["last_modified"]
+
+        with session().get(url, timeout=5, headers=headers, stream=True) as r:
+            if r.status_code == 304 and cached:
+                http_cache.set(key, cached["data"])
+                return cached["data"]["content"]
+            if r.status_code != 200:
+                print(f"Failed to fetch content from {url}")
+                return None
+
+            content_type: str = r.headers.get("content-type", "").lower()
+            content = ""
+            if "text/html" in content_type:
+                # cached in full, the prompts cut it to their own size
+                content = clean_markdown(md(extract_main_content(r.text)))
+            elif "application/pdf" in content_type:
+                pdf = save_stream(r, ".pdf")
+                if not pdf:
+                    return None
+                # already markdown, long papers are chunked by the agents instead
+                # of being cut here
+                content = extract_text_from_pdf(pdf)
+            else:
+                print(f"Unsupported content type: {content_type} for url: {url}")
+                return None
+
+        if not content.strip():
+            print(f"No content found at {url}")
             return None
-
-        content_type: str = (
-            r.headers["content-type"].lower() if "content-type" in r.headers else ""
+        http_cache.set(
+            key,
+            {
+                "content": content,
+                "etag": r.headers.get("etag"),
+                "last_modified": r.headers.get("last-modified"),
+            },
         )
-        content = ""
-        if "text/html" in content_type:
-            content = r.text
-        elif "application/pdf" in content_type:
-            download(url, filename(url))
-            content = extract_text_from_pdf(f"{output_dir}/{filename(url)}")
-        else:
-            print(f"Unsupported content type: {content_type} for url: {url}")
-            return None
-
-        return md(content)
+        return content
     except Exception:
         print(f"Failed to fetch content from {url}")
 
 
-def truncate_prompt(prompt: str, max_tokens: int, truncator) -> str:
-    if len(prompt) > max_tokens:
-        prompt = truncator(prompt, max_tokens)
-    return prompt
-
-
 def get_block_body(text: str) -> str:
     # Remove the first and last lines for ``` blocks in markdown ```
     if text.startswith("```") and text.endswith("```"):